@@ -1,13 +1,13 @@
 from os.path import join as path_join
-from os.path import exists as path_exists
-from os.path import expanduser
-from os import listdir as os_listdir
+from os import scandir as os_scandir
 from os import remove as os_remove
 from os import mkdir as os_mkdir
 
 import logging
 from getpass import getpass
+from contextlib import suppress
 
+from libretro.Config import _home_dir
 from libretro.AccountDb import AccountDb
 from libretro.Friend import Friend
 from libretro.FriendDb import FriendDb
@@ -49,9 +49,11 @@ class Account:
 		self.name      = None	# Username
 		self.mk        = None	# Master key
 		self.path      = None	# Account path
+		self.msgdir    = None	# Path to message dbs
 		self.key       = RetroPrivateKey() # Private keys
 		self.friendDb  = None	# See FriendDb
 		self.friends   = {}	# Key=userID, Value=Friend
+		self.friends_by_name = {} # Key=username, Value=Friend
 
 
 	def load(self, username, password, is_bot=False):
@@ -69,24 +71,29 @@ class Account:
 		Throws:
 		  FileNotFoundError, Exception
 		"""
-		LOG.info("Loading account '" + username +"' ...")
+		LOG.info("Loading account '%s' ...", username)
 
 		# If account is a bot-account, it is stored
 		# at ~/.retro/bots/ otherwise at ~/.retro/accounts/
 		accdir = self.conf.bots_dir if is_bot \
 			 else self.conf.accounts_dir
 		self.path = path_join(accdir, username)
+		self.msgdir = path_join(self.path, "msg")
 
-		if not path_exists(self.path):
+		# Load salt from saltfile. A missing saltfile means
+		# there's no such account, so we don't need to stat
+		# the account path before.
+		salt_file = path_join(self.path, ".salt")
+		try:
+			salt = read_salt_from_file(salt_file)
+		except FileNotFoundError:
 			raise FileNotFoundError("Account.load: "\
 				"No such account '{}' at {}"\
 				.format(username, self.path))
 
 		self.is_bot = is_bot
 
-		# Load salt from saltfile and derive master key
-		salt_file = path_join(self.path, ".salt")
-		salt = read_salt_from_file(salt_file)
+		# Derive master key from password and salt
 		self.mk = derive_key(password, salt, 16).hex()
 
 		# Load userid, username and keys from account db
@@ -110,6 +117,8 @@ class Account:
 		sqlite database (see FriendDb.py).
 		"""
 		self.friends = self.friendDb.load_all()
+		self.friends_by_name = {f.name : f
+			for f in self.friends.values()}
 
 
 	def add_friend(self, userid, username, pk_pembuf):
@@ -131,9 +140,10 @@ class Account:
 		friend.name = username
 		friend.msgdbname = FriendDb.get_random_dbname(
 					self.path)
-		friend.pubkey.load_pem_string(pk_pembuf.decode())
+		friend.pubkey.load_pem_bytes(pk_pembuf)
 		self.friendDb.add(friend)
 		self.friends[friend.id] = friend
+		self.friends_by_name[friend.name] = friend
 
 
 	def delete_friend(self, userid):
@@ -151,15 +161,15 @@ class Account:
 
 		self.friendDb.delete_by_id(friend.id)
 
-		dbpath = path_join(
-			path_join(self.path, "msg"),
-			friend.msgdbname)
+		dbpath = path_join(self.msgdir, friend.msgdbname)
 
-		# Msg database might not exist
-		try:	os_remove(dbpath)
-		except:	pass
+		# Msg database and its WAL files might not exist
+		for path in (dbpath, dbpath+'-wal', dbpath+'-shm'):
+			with suppress(FileNotFoundError):
+				os_remove(path)
 
 		self.friends.pop(userid)
+		self.friends_by_name.pop(friend.name, None)
 
 
 	def get_friend_by_id(self, userid):
@@ -167,22 +177,32 @@ class Account:
 		Get friend by userid.
 		Returns None if friend doesn't exist.
 		"""
-		return self.friends[userid]\
-			if userid in self.friends\
-			else None
+		return self.friends.get(userid)
 
 	def get_friend_by_name(self, username):
 		"""\
 		Get friend by username.
 		Returns None if friend doesn't exist.
 		"""
-		for friend in self.friends.values():
-			if friend.name == username:
-				return friend
-		return None
+		return self.friends_by_name.get(username)
+
+
+	def close(self):
+		"""\
+		Close the friends database connection.
+		"""
+		if self.friendDb:
+			self.friendDb.close()
+
 
 
 
+def _default_dir(subdir):
+	"""\
+	Return the path ~/.retro/<subdir>.
+	"""
+	return path_join(_home_dir(), '.retro', subdir)
+
 
 def get_all_accounts(accounts_dir=None):
 	"""\
@@ -192,11 +212,10 @@ def get_all_accounts(accounts_dir=None):
 	Returns None if failed to open accounts directory.
 	"""
 	if not accounts_dir:
-		accounts_dir = path_join(expanduser('~'),
-				'.retro/accounts')
+		accounts_dir = _default_dir('accounts')
 	try:
-		accounts = os_listdir(accounts_dir)
-		return accounts
+		with os_scandir(accounts_dir) as it:
+			return [e.name for e in it if e.is_dir()]
 	except:	return None
 
 
@@ -215,13 +234,9 @@ def chose_account_name(is_bot=False):
 	  The username of selected account
 	"""
 
-	if is_bot:
-		accdir = path_join(expanduser('~'),
-				'.retro/bots')
-	else:	accdir = path_join(expanduser('~'),
-				'.retro/accounts')
+	accdir = _default_dir('bots' if is_bot else 'accounts')
 
-	users = os_listdir(accdir)
+	users = get_all_accounts(accdir)
 	if not users:
 		print("You don't have any accounts yet!")
 		return None
@@ -1,8 +1,10 @@
 from os.path import join as path_join
 from os.path import exists as path_exists
 from os import mkdir as os_mkdir
+from os import makedirs as os_makedirs
 from getpass import getpass
 import logging
+import string
 
 from libretro.protocol import *
 from libretro.Config import Config
@@ -36,6 +38,11 @@ a normal user account or a bot account.
 
 LOG = logging.getLogger(__name__)
 
+# Character classes used by validate_password()
+_ASCII_LOWER  = frozenset(string.ascii_lowercase)
+_ASCII_UPPER  = frozenset(string.ascii_uppercase)
+_ASCII_DIGITS = frozenset(string.digits)
+
 class AccountCreator:
 
 	def __init__(self):
@@ -66,8 +73,7 @@ class AccountCreator:
 			self.acc_path = self.conf.bots_dir
 
 			# Create ~/.retro/bots if not exists
-			if not path_exists(self.acc_path):
-				os_mkdir(self.acc_path)
+			os_makedirs(self.acc_path, exist_ok=True)
 
 		# Connect to server, send regkey and
 		# receive userid.
@@ -307,12 +313,12 @@ class AccountCreator:
 		if l < min_len or l > max_len:
 			# Length must be in min_len,max_len
 			raise ValueError("Username '{}' has "\
-				"invalid length {}".forat(
+				"invalid length {}".format(
 				username, l))
 		elif not username.isalnum():
 			# Only alpha-numeric characters allowed
 			raise ValueError("Username '{}' contains "\
-				"invalid characters")
+				"invalid characters".format(username))
 		elif not username[0].isalpha():
 			# Name must start with alphabetic character
 			raise ValueError("Username must start with "\
@@ -332,30 +338,32 @@ class AccountCreator:
 		Raises:
 		  ValuError if password isn't secure
 		"""
-		chars = {
-			'special'  : [],
-			'numeric'  : [],
-			'lowercase': [],
-			'uppercase': []
-		}
-
 		if len(password) < min_length:
 			raise ValueError("Password too short (min={})"\
 					.format(min_length))
-		for c in password:
-			if c.isalpha() and c.islower():
-				key = 'lowercase'
-			elif c.isalpha() and c.isupper():
-				key = 'uppercase'
-			elif c.isnumeric():
-				key = 'numeric'
-			else:
-				key = 'special'
-
-			if c not in chars[key]:
-				chars[key].append(c)
-
-		for k,v in chars.items():
+
+		# Only distinct characters matter, so classify
+		# the set of characters instead of every single one.
+		chars = set(password)
+
+		if password.isascii():
+			lower   = chars & _ASCII_LOWER
+			upper   = chars & _ASCII_UPPER
+			numeric = chars & _ASCII_DIGITS
+		else:
+			lower,upper,numeric = set(),set(),set()
+			for c in chars:
+				if c.isalpha() and c.islower():
+					lower.add(c)
+				elif c.isalpha() and c.isupper():
+					upper.add(c)
+				elif c.isnumeric():
+					numeric.add(c)
+
+		special = chars - lower - upper - numeric
+
+		for k,v in (('special', special), ('numeric', numeric),
+			    ('lowercase', lower), ('uppercase', upper)):
 			if len(v) < 2:
 				raise ValueError("Password needs at "\
 					"least 2 different {} charakters"\
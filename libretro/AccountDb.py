@@ -46,6 +46,7 @@ class AccountDb:
 		"""
 		rsa,ec = retroPrivKey.get_pem_strings()
 		db = self.__open(pw)
+		db.execute(self.CREATE_TABLE)
 		q = "INSERT INTO account VALUES (?,?,?,?)"
 		db.execute(q, (userid, username, rsa, ec))
 		db.commit()
@@ -60,7 +61,8 @@ class AccountDb:
 		  userid,username,RetroPrivKey
 		"""
 		db = self.__open(pw)
-		row = db.execute("SELECT * FROM account").fetchone()
+		row = db.execute("SELECT _id,_name,_rsa,_ec "\
+				"FROM account LIMIT 1").fetchone()
 		userid = row[0]
 		username = row[1]
 		privkey = RetroPrivateKey()
@@ -74,6 +76,4 @@ class AccountDb:
 		db = sqlcipher.connect(self.db_path,
 				check_same_thread=False)
 		db.execute("pragma key='" + pw + "'")
-		db.execute(self.CREATE_TABLE)
-		db.commit()
 		return db
@@ -1,8 +1,10 @@
 import configparser
 from os.path import join   as path_join
-from os.path import exists as path_exists
+from os.path import isdir  as path_isdir
+from os import makedirs    as os_makedirs
 from os.path import expanduser
 import logging
+from functools import lru_cache
 
 import traceback
 
@@ -15,18 +17,46 @@ LOG = logging.getLogger(__name__)
 
 RETRO_MAX_FILESIZE = 0x40000000
 
+
+@lru_cache(maxsize=1)
+def _home_dir():
+	# Users home directory, expanded only once.
+	return expanduser('~')
+
+
+@lru_cache(maxsize=1)
+def _download_dir():
+	"""\
+	Get the directory where downloaded files are stored.
+	This is ~/downloads or ~/Downloads if one of them exists,
+	otherwise ~/.retro/downloads is created and used.
+	The result is cached, so the lookup is done only once.
+	"""
+	home = _home_dir()
+
+	for dir in ("downloads", "Downloads"):
+		path = path_join(home, dir)
+		if path_isdir(path):
+			return path
+
+	# No valid download directory, create our own
+	# one at ~/.retro/downloads
+	path = path_join(home, ".retro/downloads")
+	os_makedirs(path, exist_ok=True)
+	return path
+
+
 class Config:
 	def __init__(self, basedir=None):
 
 		if not basedir:
-			basedir = path_join(expanduser('~'),
-					'.retro')
+			basedir = path_join(_home_dir(), '.retro')
 
 		self.basedir      = basedir
 		self.config_file  = path_join(self.basedir, "config.txt")
 		self.accounts_dir = path_join(self.basedir, "accounts")
 		self.bots_dir     = path_join(self.basedir, "bots")
-		self.download_dir = self.__get_download_dir()
+		self.download_dir = _download_dir()
 
 		# [default]
 		self.loglevel     = logging.INFO
@@ -50,7 +80,7 @@ class Config:
 		  Exception: If failed to open/read config file
 		"""
 		try:
-			LOG.debug("Loading configs from " + self.config_file)
+			LOG.debug("Loading configs from %s", self.config_file)
 			conf = configparser.ConfigParser()
 			conf.read(self.config_file)
 
@@ -86,17 +116,20 @@ class Config:
 
 
 	def debug(self):
+		if not LOG.isEnabledFor(logging.DEBUG):
+			return
+
 		LOG.debug("SETTINGS:")
 		LOG.debug("[default]")
-		LOG.debug("  loglevel       = {}".format(self.loglevel))
-		LOG.debug("  logfile        = {}".format(self.logfile))
-		LOG.debug("  logformat      = '{}'".format(self.logformat))
-		LOG.debug("  recv_timeout   = {}".format(self.recv_timeout))
+		LOG.debug("  loglevel       = %s", self.loglevel)
+		LOG.debug("  logfile        = %s", self.logfile)
+		LOG.debug("  logformat      = '%s'", self.logformat)
+		LOG.debug("  recv_timeout   = %s", self.recv_timeout)
 		LOG.debug("[server]")
-		LOG.debug("  address        = {}".format(self.server_address))
-		LOG.debug("  hostname       = {}".format(self.server_hostname))
-		LOG.debug("  port           = {}".format(self.server_port))
-		LOG.debug("  fileport       = {}".format(self.server_fileport))
+		LOG.debug("  address        = %s", self.server_address)
+		LOG.debug("  hostname       = %s", self.server_hostname)
+		LOG.debug("  port           = %s", self.server_port)
+		LOG.debug("  fileport       = %s", self.server_fileport)
 
 
 	def loglevel_string_to_level(self, loglevel_str):
@@ -122,18 +155,3 @@ class Config:
 		else:
 			return levels[levstr]
 
-
-	def __get_download_dir(self):
-		home = expanduser('~')
-		check_dirs = ["downloads", "Downloads"]
-
-		for dir in check_dirs:
-			path = path_join(home, dir)
-			if path_exists(path):
-				return path
-
-		# No valid download directory, create our own
-		# one at ~/.retro/downloads
-		path = path_join(home, ".retro/downloads")
-		os_mkdir(path)
-		return path
@@ -1,6 +1,8 @@
 import logging
+import struct
+import hashlib
 
-from os      import stat     as os_stat
+from os.path import getsize  as path_getsize
 from os.path import join     as path_join
 from os.path import basename as path_basename
 from base64  import b64encode,b64decode
@@ -9,30 +11,35 @@ from libretro.protocol import *
 from libretro.Config import RETRO_MAX_FILESIZE
 from libretro.Friend import Friend
 from libretro.net    import NetClient
-from libretro.crypto import hash_sha256, random_buffer
+from libretro.crypto import random_buffer
 from libretro.crypto import aes_encrypt_from_file
-from libretro.crypto import aes_decrypt_to_file
+from libretro.crypto import aes_decrypt_chunks_to_file
 
 
 LOG = logging.getLogger(__name__)
 
+# Filesize field of T_FILE_UPLOAD/T_FILE_DOWNLOAD packets
+_U32 = struct.Struct('!I')
+
+
+# Divisor, unit and number of decimals per size unit
+_SIZE_UNITS = (
+	(1,       " b",  0),
+	(1 << 10, " Kb", 1),
+	(1 << 20, " Mb", 2),
+	(1 << 30, " Gb", 3)
+)
 
 def filesize_to_string(filesize):
 	"""\
 	Returns formatted string from given filesize.
 	"""
-	KB = 1024
-	MB = KB*KB
-	GB = MB*KB
-
-	if filesize < KB:
+	# Unit index is given by the number of 10 bit groups.
+	i = min(max(filesize.bit_length()-1, 0) // 10, 3)
+	if i == 0:
 		return str(filesize) + " b"
-	elif filesize < MB:
-		return str(round(filesize/KB,1)) + " Kb"
-	elif filesize < GB:
-		return str(round(filesize/MB, 2)) + " Mb"
-	else:
-		return str(round(filesize/GB, 3)) + " Gb"
+	div,unit,ndigits = _SIZE_UNITS[i]
+	return str(round(filesize/div, ndigits)) + unit
 
 """\
 Logic for transferring a file between two retro clients.
@@ -81,10 +88,10 @@ class FileTransfer:
 		"""
 		try:
 			filename = path_basename(filepath)
-			filesize = os_stat(filepath).st_size
+			filesize = path_getsize(filepath)
 			fileid   = self.__get_fileid(filename)
 		except Exception as e:
-			LOG.error("upload: "+str(e))
+			LOG.error("upload: %s", e)
 			raise
 
 		# Encrypt/compress file
@@ -100,7 +107,7 @@ class FileTransfer:
 
 		# Send initial packet (fileid and filesize)
 		conn.send_packet(Proto.T_FILE_UPLOAD,
-			fileid, struct.pack('!I', len(data)))
+			fileid, _U32.pack(len(data)))
 
 		self.__recv_ok(conn)
 
@@ -109,7 +116,7 @@ class FileTransfer:
 
 		self.__recv_ok(conn)
 		conn.close()
-		LOG.debug("Uploaded file "+filepath)
+		LOG.debug("Uploaded file %s", filepath)
 
 		# Send file-message to user
 		file_dict = {
@@ -121,7 +128,7 @@ class FileTransfer:
 		msg,e2e_buffer = self.cli.msgHandler.make_file_msg(
 					friend,	file_dict)
 		self.cli.send_packet(Proto.T_FILEMSG, e2e_buffer)
-		LOG.debug("Sent filemsg to "+friend.name)
+		LOG.debug("Sent filemsg to %s", friend.name)
 
 		return filename,filesize
 
@@ -157,33 +164,41 @@ class FileTransfer:
 		# Must receive T_SUCCESS and filesize
 		pckt = self.__recv_ok(conn)
 
-		filesize = struct.unpack('!I', pckt[1])[0]
-		data     = b''
-		nrecv    = 0
-
-		# Receive file contents
-		while nrecv < filesize:
-			buf = conn.recv(timeout_sec=self.conf.recv_timeout)
-			if not buf: break
-			data  += buf
-			nrecv += len(buf)
-		conn.close()
+		filesize = _U32.unpack(pckt[1])[0]
 
-		if nrecv != filesize:
-			raise Exception("FileTransfer: Failed to download "\
-				"'{}', stopped at {}/{}".format(filename,
-				nrecv, filesize))
-
-		# Decrypt/Decompress and store to file
+		# Receive, decrypt/decompress and store the file
+		# chunk by chunk.
 		try:
-			aes_decrypt_to_file(key, data, filepath)
+			aes_decrypt_chunks_to_file(key,
+				self.__recv_chunks(conn, filesize),
+				filepath)
 		except Exception as e:
-			raise Exception("Failed to decrypt file"\
+			raise Exception("Failed to download file"\
 				" '{}': {}".format(filename, e))
+		finally:
+			conn.close()
 
 		return filename,filesize
 
 
+	def __recv_chunks(self, conn, filesize):
+		# Generator yielding the received file contents
+		# chunk by chunk until filesize bytes are received.
+		# All chunks are received into the same buffer, so
+		# each yielded view is only valid until the next one.
+		# Raises Exception on timeout.
+		nrecv = 0
+		buf   = memoryview(bytearray(0x10000))
+		while nrecv < filesize:
+			n = conn.recv_into(buf, min(filesize-nrecv, len(buf)),
+				timeout_sec=self.conf.recv_timeout)
+			if not n:
+				raise Exception("Download stopped "\
+					"at {}/{}".format(nrecv, filesize))
+			nrecv += n
+			yield buf[:n]
+
+
 	def __connect(self):
 		#Connect to fileserver.
 		try:
@@ -195,7 +210,7 @@ class FileTransfer:
 			cli.connect()
 			return cli
 		except Exception as e:
-			LOG.error("Failed to connect to fileserver, "+str(e))
+			LOG.error("Failed to connect to fileserver, %s", e)
 			raise e
 
 
@@ -226,9 +241,8 @@ class FileTransfer:
 	def __get_fileid(self, filename):
 		# Generate fileid out of filename and random
 		idbuf  = filename.encode()+random_buffer(16)
-		fileid = hash_sha256(idbuf)[:Proto.FILEID_SIZE]
+		fileid = hashlib.blake2b(idbuf,
+				digest_size=Proto.FILEID_SIZE).digest()
 		return fileid
 
-		return os_stat(path).st_size
-
 
@@ -16,6 +16,9 @@ class Friend:
 		 |__ ...
 	"""
 
+	__slots__ = ('id', 'name', '_pubkey', '_pubkey_pem',
+		     'msgdbname', 'status', 'unseen_msgs')
+
 	ONLINE  = 0
 	OFFLINE = 1
 	UNKNOWN = 2
@@ -24,7 +27,11 @@ class Friend:
 
 		self.id     = None	# Friends userid (8 byte)
 		self.name   = None	# Friends username
-		self.pubkey = RetroPublicKey() # Friends pubkey
+
+		# Friends pubkey (see Friend.pubkey) and the PEM
+		# strings it will be parsed from on first access.
+		self._pubkey     = None
+		self._pubkey_pem = None
 
 		# Name of database holding all messages sent between
 		# user and friend. This is a random name, generated
@@ -38,3 +45,33 @@ class Friend:
 		# For gui purpose only..
 		self.unseen_msgs = 0
 
+
+	@property
+	def pubkey(self):
+		"""\
+		Friends public key (RetroPublicKey).
+		If the PEM strings were set with set_pubkey_pem_strings(),
+		they get parsed here when the key is used the first time.
+		"""
+		if self._pubkey is None:
+			pubkey = RetroPublicKey()
+			if self._pubkey_pem:
+				pubkey.load_pem_strings(*self._pubkey_pem)
+				self._pubkey_pem = None
+			self._pubkey = pubkey
+		return self._pubkey
+
+
+	@pubkey.setter
+	def pubkey(self, pubkey):
+		self._pubkey     = pubkey
+		self._pubkey_pem = None
+
+
+	def set_pubkey_pem_strings(self, rsa_pem, ec_pem):
+		"""\
+		Set the friends public keys as PEM strings.
+		Parsing is deferred until the pubkey is accessed.
+		"""
+		self._pubkey     = None
+		self._pubkey_pem = (rsa_pem, ec_pem)
@@ -1,9 +1,10 @@
 from os.path import join as path_join
 from os.path import exists as path_exists
 import logging
-from sqlcipher3 import dbapi2 as sqlcipher
+from threading import Lock
 
 from libretro.Friend import Friend
+from libretro.db import sqlcipher_connect
 from libretro.crypto import hash_sha256, random_buffer, derive_key
 
 LOG = logging.getLogger(__name__)
@@ -71,30 +72,35 @@ class FriendDb:
 		self.key = derive_key(account.mk,
 				salt=account.id, keylen=16).hex()
 
+		# The database connection is opened on first use and
+		# then kept open, so the key setup is done only once.
+		self.db   = None
+		self.lock = Lock()
+
 
 	def add(self, friend):
 		"""\
 		Add friend to database.
 		"""
-		db = self.__open()
 		rsapem,ecpem = friend.pubkey.get_pem_strings()
-		db.execute(
-			"INSERT INTO friends VALUES (?,?,?,?,?)",
-			(friend.id, friend.name, rsapem,
-			ecpem, friend.msgdbname))
-		db.commit()
-		db.close()
+		with self.lock:
+			db = self.__open()
+			db.execute(
+				"INSERT INTO friends VALUES (?,?,?,?,?)",
+				(friend.id, friend.name, rsapem,
+				ecpem, friend.msgdbname))
+			db.commit()
 
 
 	def delete_by_id(self, userid):
 		"""\
 		Delete Friend by userid.
 		"""
-		db = self.__open()
-		db.execute("DELETE FROM friends"\
-			" WHERE _id=?;", (userid,))
-		db.commit()
-		db.close()
+		with self.lock:
+			db = self.__open()
+			db.execute("DELETE FROM friends"\
+				" WHERE _id=?;", (userid,))
+			db.commit()
 
 
 	def load_all(self):
@@ -103,31 +109,41 @@ class FriendDb:
 		a dictionary where ids are the friendids and
 		values are Friend instances.
 		"""
-		db  = self.__open()
-		friends = {}
 		q = "SELECT * FROM friends"
+		with self.lock:
+			rows = self.__open().execute(q).fetchall()
 
-		for row in db.execute(q):
-			LOG.debug("Loading friend '"+row[1]+"' ...")
-			LOG.debug("Row len: {}".format(len(row)))
-			LOG.debug("DB ROW: [\n"+row[2]+"\n]\n")
+		friends = {}
+		for row in rows:
+			LOG.debug("Loading friend '%s' ...", row[1])
 			friend = Friend()
 			friend.id = row[0]
 			friend.name = row[1]
-			friend.pubkey.load_pem_strings(row[2], row[3])
+			friend.set_pubkey_pem_strings(row[2], row[3])
 			friend.msgdbname = row[4]
 			friends[friend.id] = friend
 
-		db.close()
 		return friends
 
 
+	def close(self):
+		"""\
+		Close database connection.
+		"""
+		with self.lock:
+			if self.db:
+				self.db.close()
+				self.db = None
+
+
 	def __open(self):
 		"""
-		Open database.
+		Open database if not already open and return
+		the connection. Must be called with self.lock held.
 		"""
-		db = sqlcipher.connect(self.path, check_same_thread=False)
-		db.execute("pragma key='" + self.key + "'")
-		db.execute(FriendDb.CREATE_TABLE_FRIENDS)
-		db.commit()
-		return db
+		if not self.db:
+			db = sqlcipher_connect(self.path, self.key)
+			db.execute(FriendDb.CREATE_TABLE_FRIENDS)
+			db.commit()
+			self.db = db
+		return self.db
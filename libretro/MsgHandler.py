@@ -1,4 +1,7 @@
-from time import strftime
+from time import strftime, localtime, time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
 import logging
 import json
 
@@ -46,6 +49,23 @@ An encrypted chat message looks like:
 
 """
 
+
+@lru_cache(maxsize=1)
+def _minute_string(minute):
+	"""\
+	Format given minute (minutes since epoch) as 'yy-mm-dd HH:MM'.
+	Cached, so strftime only runs once per minute.
+	"""
+	return strftime('%y-%m-%d %H:%M', localtime(minute*60))
+
+
+def _now():
+	"""\
+	Get current local time as 'yy-mm-dd HH:MM'.
+	"""
+	return _minute_string(int(time()//60))
+
+
 class MsgHandler:
 
 
@@ -87,10 +107,10 @@ class MsgHandler:
 		enc, iv = aes_encrypt(kE, text.encode())
 
 		# Calculate hmac of IV+enc_data using sign key (kS)
-		hmac = hmac_sha256(kS, iv+enc)
+		hmac = hmac_sha256(kS, iv, enc)
 
 		# Get current date
-		now = strftime('%y-%m-%d %H:%M')
+		now = _now()
 
 		# Create RSA encrypted header (kM+IV+HMAC+Timestamp).
 		header_raw = kM + iv + hmac + now.encode()
@@ -100,8 +120,8 @@ class MsgHandler:
 		signature = self.account.key.sign(enc)
 
 		# Create e2e packet buffer
-		e2e_buf = self.account.id + friend.id + \
-			  header + signature + enc
+		e2e_buf = b''.join((self.account.id, friend.id,
+				    header, signature, enc))
 
 		# Create message dictionaries
 		msg = {
@@ -186,7 +206,7 @@ class MsgHandler:
 		# Calculate HMAC from iv+encrypted message using
 		# extracted encryption key (kE) and see if it's
 		# the same as the received one.
-		hmac2 = hmac_sha256(kS, iv+mbody)
+		hmac2 = hmac_sha256(kS, iv, mbody)
 		if hmac != hmac2:
 			LOG.warning("HMAC's do not match!")
 			LOG.warning("  hmac1: "+hmac.hex())
@@ -218,6 +238,39 @@ class MsgHandler:
 
 
 
+	def decrypt_msgs(self, pckts):
+		"""\
+		Decrypt a batch of end2end messages (see decrypt_msg).
+
+		The messages are decrypted in a thread pool. Most of
+		the work (rsa, ed25519, aes, hmac) is done by OpenSSL
+		which releases the GIL, so this scales with the number
+		of cpu cores. The account's keys and friends must not
+		be changed while the batch is running.
+
+		Args:
+		  pckts: List of (msg_type, e2e_msg) tuples
+		Return:
+		  List of (friend, message) tuples in the same order as
+		  the given packets. Messages that failed to decrypt are
+		  logged and set to None.
+		"""
+		def decrypt(pckt):
+			try:
+				return self.decrypt_msg(pckt[0], pckt[1])
+			except Exception as e:
+				LOG.warning("Failed to decrypt msg, %s", e)
+				return None
+
+		if len(pckts) < 2:
+			return [decrypt(p) for p in pckts]
+
+		nworkers = min(len(pckts), cpu_count() or 1)
+		with ThreadPoolExecutor(max_workers=nworkers) as pool:
+			return list(pool.map(decrypt, pckts))
+
+
+
 	def get_message(self, sender, receiver, text,
 			unseen=False, msgtype=Proto.T_CHATMSG):
 		"""\
@@ -227,7 +280,7 @@ class MsgHandler:
 			'type'   : msgtype,
 			'from'   : sender,
 			'to'     : receiver,
-			'time'   : strftime('%y-%m-%d %H:%M'),
+			'time'   : _now(),
 			'msg'    : text,
 			'unseen' : unseen
 		}
@@ -1,11 +1,12 @@
 from os.path import join as path_join
 from os.path import basename as path_basename
 import logging
-from sqlcipher3 import dbapi2 as sqlcipher
-from time import time as time_now
+from time import monotonic as time_now
+from collections import OrderedDict
 
 from libretro.protocol import Proto
 from libretro.crypto import derive_key
+from libretro.db import sqlcipher_connect
 
 LOG = logging.getLogger(__name__)
 
@@ -21,20 +22,32 @@ All message db's are located at ~/.retro/accounts/<USER>/msg/
 """
 class MsgStore:
 
-	def __init__(self, account, close_conversation_after=5*60):
+	def __init__(self, account, close_conversation_after=5*60,
+			max_open=32):
 		"""
 		Init message store.
 		Args:
 		  account: Retro user account
 		  close_conversation_after: Timeout for closing db
+				(None = keep open until evicted)
+		  max_open: Max number of open conversations. If
+			    exceeded, the least recently used one
+			    is closed.
 		"""
 		self.account = account
 		self.path    = path_join(account.path, "msg")
 		self.close_conversation_after = close_conversation_after
+		self.max_open = max_open
 
 		# Dictionary with conversations where key=FriendName
-		# and value=Conversation
-		self.conversations = {}
+		# and value=Conversation. Ordered by last access, so
+		# the least recently used conversation comes first.
+		self.conversations = OrderedDict()
+
+		# Derived database keys where key=FriendID, so the
+		# key derivation only runs once per friend and not
+		# each time a closed conversation is reopened.
+		self.db_keys = {}
 
 
 	def close(self):
@@ -43,6 +56,8 @@ class MsgStore:
 		"""
 		for db in self.conversations.values():
 			db.close()
+		self.conversations.clear()
+		self.db_keys.clear()
 
 
 	def add_msg(self, friend, msg):
@@ -148,15 +163,19 @@ class MsgStore:
 		Make sure there's an open conversation with
 		given friend.
 		"""
-		if friend.name not in self.conversations:
-
-			db_path = path_join(
-				path_join(self.account.path, "msg"),
-				friend.msgdbname)
-			db_key = derive_key(self.account.mk,
-					salt=friend.id,
-					iterations=100000,
-					keylen=16).hex()
+		conv = self.conversations.get(friend.name)
+		if conv:
+			conv.last_action = time_now()
+			self.conversations.move_to_end(friend.name)
+		else:
+			db_path = path_join(self.path, friend.msgdbname)
+			db_key = self.db_keys.get(friend.id)
+			if not db_key:
+				db_key = derive_key(self.account.mk,
+						salt=friend.id,
+						iterations=100000,
+						keylen=16).hex()
+				self.db_keys[friend.id] = db_key
 
 			conv = MsgDB()
 			conv.open(db_path, db_key)
@@ -166,16 +185,22 @@ class MsgStore:
 	def _close_unused_conversations(self):
 		"""
 		Close conversations that have not been updated
-		since self.close_conversation_after seconds.
+		since self.close_conversation_after seconds and
+		the least recently used ones if there are more than
+		self.max_open conversations.
 		"""
 		now = time_now()
-		fr_names = list(self.conversations.keys())
+		timeout = self.close_conversation_after
 
-		for name in fr_names:
-			conv = self.conversations[name]
-			if now - conv.last_action > 20*60:
-				conv.close()
-				self.conversations.pop(name)
+		# Conversations are ordered by last access, so we
+		# can stop at the first one that is still in use.
+		while self.conversations:
+			name,conv = next(iter(self.conversations.items()))
+			if len(self.conversations) <= self.max_open and \
+			   (timeout == None or now - conv.last_action <= timeout):
+				break
+			conv.close()
+			self.conversations.popitem(last=False)
 
 
 
@@ -248,6 +273,47 @@ class MsgDB:
 			_downloaded INTEGER,
 			FOREIGN KEY (_msgid) REFERENCES msg(_id));'''
 
+	# Indexes for sorting by time, counting unseen messages
+	# (partial index, only unseen rows) and file lookups.
+	CREATE_INDEXES = (
+		"CREATE INDEX IF NOT EXISTS idx_msg_time "\
+			"ON msg(_time);",
+		"CREATE INDEX IF NOT EXISTS idx_msg_unseen "\
+			"ON msg(_unseen) WHERE _unseen=1;",
+		"CREATE INDEX IF NOT EXISTS idx_files_msgid "\
+			"ON files(_msgid);",
+		"CREATE INDEX IF NOT EXISTS idx_files_fileid "\
+			"ON files(_fileid);"
+	)
+
+	# All queries used by MsgDB
+	INSERT_MSG = "INSERT INTO msg (_type,_from,_to,_time,_msg,"\
+			"_unseen) VALUES (?, ?, ?, ?, ?, ?);"
+	INSERT_FILE = "INSERT INTO files VALUES (?,?,?,?,?,?);"
+
+	# Messages joined with their file infos (which are NULL
+	# for chat messages), so a single query is enough.
+	# Both type parameters are set to the same type to select
+	# just one of them.
+	SELECT_MSGS_JOIN = "SELECT m.*, f._fileid, f._filename, "\
+			"f._size, f._key, f._downloaded FROM msg m "\
+			"LEFT JOIN files f ON f._msgid=m._id "\
+			"WHERE m._type IN (?,?) "
+	SELECT_MSGS = SELECT_MSGS_JOIN + "ORDER BY m._time, m._id;"
+	# Last n messages (newest first)
+	SELECT_LAST_MSGS = SELECT_MSGS_JOIN + \
+			"ORDER BY m._time DESC, m._id DESC LIMIT ?;"
+	SELECT_MSG_BY_ID = "SELECT * FROM msg WHERE _id=?"
+	SELECT_LAST_MSGID = "SELECT max(_id) FROM msg;"
+	SELECT_NUM_UNSEEN = "SELECT count(*) FROM msg WHERE _unseen=1;"
+
+	DELETE_MSG = "DELETE FROM msg WHERE _id=?"
+	DELETE_FILE = "DELETE FROM files WHERE _msgid=?"
+
+	UPDATE_ALL_SEEN = "UPDATE msg SET _unseen=0 WHERE _unseen=1;"
+	UPDATE_DOWNLOADED = "UPDATE files SET _downloaded=1 "\
+			"WHERE _fileid=?;"
+
 	def __init__(self):
 		"""
 		Args:
@@ -270,10 +336,19 @@ class MsgDB:
 		"""
 		self.path = path
 		pw = password + path_basename(path)
-		self.db = sqlcipher.connect(path, check_same_thread=False)
-		self.db.execute("pragma key='" + pw + "'")
+		self.db = sqlcipher_connect(path, pw)
+
+		# Write ahead log instead of a rollback journal,
+		# which only needs to be synced on checkpoints.
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("PRAGMA synchronous=NORMAL")
+		self.db.execute("PRAGMA temp_store=MEMORY")
+		self.db.execute("PRAGMA cache_size=-8000")
+
 		self.db.execute(MsgDB.CREATE_TABLE_MSG)
 		self.db.execute(MsgDB.CREATE_TABLE_FILES)
+		for q in MsgDB.CREATE_INDEXES:
+			self.db.execute(q)
 		self.db.commit()
 		pw = None
 
@@ -312,27 +387,12 @@ class MsgDB:
 		if not self.db:
 			raise ValueError("MsgDB.add_msg: Database closed")
 
-		# Create entry in table 'msg'...
-		q  = "INSERT INTO msg (_type,_from,_to,_time,_msg,_unseen)"\
-			" VALUES (?, ?, ?, ?, ?, ?);"
-		self.db.execute(q, (msg['type'], msg['from'], msg['to'],
-				msg['time'], msg['msg'], msg['unseen']))
-		self.db.commit()
-
-		# Get id of this messge
-		msgid = self.get_last_msgid()
-
-		if msg['type'] == Proto.T_FILEMSG:
-			# Message is 'file-message', create entry in
-			# table 'files'...
-			q = "INSERT INTO files VALUES (?,?,?,?,?,?);"
-			self.db.execute(q, (msgid,
-					msg['fileid'],
-					msg['filename'],
-					msg['size'],
-					msg['key'],
-					msg['downloaded']))
+		try:
+			msgid = self.__insert_msg(msg)
 			self.db.commit()
+		except:
+			self.db.rollback()
+			raise
 
 		self.last_action = time_now()
 		return msgid
@@ -341,11 +401,25 @@ class MsgDB:
 	def add_msgs(self, msgs):
 		"""
 		Add a list of messages.
+		All messages are inserted within a single transaction,
+		so either all or none of them are stored.
+		Return:
+		  List with ids of the added messages
 		Throws:
 		  Exception
 		"""
-		for msg in msgs:
-			self.add_msg(msg)
+		if not self.db:
+			raise ValueError("MsgDB.add_msgs: Database closed")
+
+		try:
+			msgids = [self.__insert_msg(msg) for msg in msgs]
+			self.db.commit()
+		except:
+			self.db.rollback()
+			raise
+
+		self.last_action = time_now()
+		return msgids
 
 
 	def get_msgs(self, last_n=None, pckt_type=None):
@@ -367,23 +441,27 @@ class MsgDB:
 		msgs = []
 
 		if pckt_type:
-			q = "SELECT * FROM msg WHERE _type=? ORDER BY _time;"
-			result = self.db.execute(q, (pckt_type,))
+			types = (pckt_type, pckt_type)
+		else:	types = (Proto.T_CHATMSG, Proto.T_FILEMSG)
+
+		# If last_n is set, only the last n rows are selected
+		# (in reverse order) and reversed afterwards.
+		if last_n != None:
+			result = self.db.execute(MsgDB.SELECT_LAST_MSGS,
+					types + (last_n,))
 		else:
-			q = "SELECT * FROM msg ORDER BY _time;"
-			result = self.db.execute(q)
+			result = self.db.execute(MsgDB.SELECT_MSGS, types)
 
 		for row in result:
-			if row[1] == Proto.T_CHATMSG:
-				msg = self.__row_to_msg(row)
-			elif row[1] == Proto.T_FILEMSG:
-				msg = self.__get_filemsg(row)
-			else:	continue
-			msgs.append(msg)
+			if row[1] != Proto.T_FILEMSG:
+				msgs.append(self.__row_to_msg(row))
+			elif row[7] != None:
+				# Skip file-messages without file infos
+				msgs.append(self.__row_to_filemsg(row))
 
 		if last_n != None:
-			return msgs[-last_n:]
-		else:	return msgs
+			msgs.reverse()
+		return msgs
 
 
 	def delete_msg(self, msgid):
@@ -396,12 +474,10 @@ class MsgDB:
 		if not msg: return False
 
 		if msg['type'] == Proto.T_FILEMSG:
-			q = "DELETE FROM files WHERE _msgid=?"
-			self.db.execute(q, (msgid,))
+			self.db.execute(MsgDB.DELETE_FILE, (msgid,))
 			self.db.commit()
 
-		q = "DELETE FROM msg WHERE _id=?"
-		self.db.execute(q, (msgid,))
+		self.db.execute(MsgDB.DELETE_MSG, (msgid,))
 		self.db.commit()
 
 
@@ -409,8 +485,7 @@ class MsgDB:
 		"""
 		Set unseen=0 to all messages.
 		"""
-		q  = "UPDATE msg SET _unseen=0;"
-		self.db.execute(q)
+		self.db.execute(MsgDB.UPDATE_ALL_SEEN)
 		self.db.commit()
 
 
@@ -418,9 +493,7 @@ class MsgDB:
 		"""
 		Get number of unseen messages.
 		"""
-		q = "SELECT count(*) FROM msg "\
-			"WHERE _unseen=1;"
-		res = self.db.execute(q)
+		res = self.db.execute(MsgDB.SELECT_NUM_UNSEEN)
 		return res.fetchone()[0]
 
 
@@ -430,9 +503,7 @@ class MsgDB:
 		Args:
 		  fileid: FileID as hex string (len=32)
 		"""
-		q = "UPDATE files SET _downloaded=1 "\
-			"WHERE _fileid=?;"
-		self.db.execute(q, (fileid,))
+		self.db.execute(MsgDB.UPDATE_DOWNLOADED, (fileid,))
 		self.db.commit()
 
 
@@ -440,20 +511,45 @@ class MsgDB:
 		"""\
 		Get id of last inserted message.
 		"""
-		q = "SELECT max(_id) FROM msg;"
-		res = self.db.execute(q)
+		res = self.db.execute(MsgDB.SELECT_LAST_MSGID)
 		return int(res.fetchone()[0])
 
 
 	# ---- PRIVATE -------------------------------------------------
 
+	def __insert_msg(self, msg):
+		"""\
+		Insert message (and file entry if file-message)
+		without committing.
+		Return:
+		  Id of message (column '_id')
+		"""
+		# Create entry in table 'msg'...
+		cur = self.db.execute(MsgDB.INSERT_MSG,
+				(msg['type'], msg['from'],
+				msg['to'], msg['time'], msg['msg'],
+				msg['unseen']))
+
+		# Get id of this messge
+		msgid = cur.lastrowid
+
+		if msg['type'] == Proto.T_FILEMSG:
+			# Message is 'file-message', create entry in
+			# table 'files'...
+			self.db.execute(MsgDB.INSERT_FILE, (msgid,
+					msg['fileid'],
+					msg['filename'],
+					msg['size'],
+					msg['key'],
+					msg['downloaded']))
+		return msgid
+
 	def __get_msg_by_id(self, msgid):
 		"""\
 		Get message by id.
 		Returns None if message not found.
 		"""
-		q = "SELECT * FROM msg WHERE _id=?"
-		res = self.db.execute(q, (msgid,))
+		res = self.db.execute(MsgDB.SELECT_MSG_BY_ID, (msgid,))
 		if not res: return None
 		return self.__row_to_msg(res.fetchone())
 
@@ -472,31 +568,15 @@ class MsgDB:
 			'unseen' : row[6] }
 
 
-	def __get_filemsg(self, msg_row, downloaded=None):
+	def __row_to_filemsg(self, row):
 		"""\
-		Build file-message from row of table 'msg'
-		and selected file infos from table 'files'.
-		Args:
-		  msg_row:
-		  downloaded:
-			None    = Don't care
-			0|False = Only not downloaded
-			1|True  = Only downloaded
-		Return:
-		  Message with type 'file-message' or
-		  None on error or missing data.
-		"""
-		q = "SELECT * FROM files WHERE _msgid=?"
-		if downloaded != None:
-			q += " AND _downloaded={}".format(downloaded)
-
-		msg = self.__row_to_msg(msg_row)
-
-		for file_row in self.db.execute(q, (msg_row[0],)):
-			msg['fileid']     = file_row[1]
-			msg['filename']   = file_row[2]
-			msg['size']       = file_row[3]
-			msg['key']        = file_row[4]
-			msg['downloaded'] = file_row[5]
-			return msg
-		return None
+		Convert given row (from table 'msg' joined with
+		table 'files') to a file-message dictionary.
+		"""
+		msg = self.__row_to_msg(row)
+		msg['fileid']     = row[7]
+		msg['filename']   = row[8]
+		msg['size']       = row[9]
+		msg['key']        = row[10]
+		msg['downloaded'] = row[11]
+		return msg
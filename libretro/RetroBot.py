@@ -41,7 +41,7 @@ bot.run()
 from os      import listdir  as os_listdir
 from os.path import join     as path_join
 
-import time
+from threading import Event
 import logging
 
 from libretro.protocol import *
@@ -69,9 +69,24 @@ class RetroBot:
 		self.fileTrans  = FileTransfer(self.cli) # FileTransfer
 		self.deamonize  = daemonize	# TODO
 		self.pidfile    = pidfile	# TODO
+		self.stopped    = Event()	# Set if bot is done
 		self.done       = True		# Done?
 
 
+	@property
+	def done(self):
+		"""\
+		Is bot done? Setting this to True stops the bot,
+		also if it is currently sleeping.
+		"""
+		return self.stopped.is_set()
+
+	@done.setter
+	def done(self, done):
+		if done: self.stopped.set()
+		else:	 self.stopped.clear()
+
+
 	def create_account(self, regkey_file):
 		"""\
 		Create bot account.
@@ -191,9 +206,21 @@ class RetroBot:
 		# Quitting ...
 		self.cli.send_packet(Proto.T_GOODBYE)
 		self.cli.close()
+		self.cli.account.close()
 
 
 
+	def stop(self):
+		"""\
+		Stop the bot's main loop.
+		This may be called from another thread, but not
+		from a signal handler (Event.set() would deadlock
+		if the signal arrives while the main thread holds
+		the Event's lock in __sleep()).
+		"""
+		self.done = True
+
+
 	def send_msg(self, friend:Friend, text:str):
 		"""\
 		Send end2end encrypted message to given friend.
@@ -289,6 +316,4 @@ class RetroBot:
 		Sleep given amount of seconds.
 		Quits if bot stopped while sleeping.
 		"""
-		for i in range(seconds):
-			if self.done: break
-			time.sleep(1)
+		self.stopped.wait(seconds)
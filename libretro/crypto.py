@@ -10,6 +10,12 @@ author: Lukas Wiese (16.May 2023)
 from os import chmod as os_chmod
 from os import urandom as os_urandom
 from os import stat as os_stat
+from os import remove as os_remove
+from os import replace as os_replace
+from contextlib import suppress
+from tempfile import TemporaryFile
+from os.path import dirname as path_dirname
+from os.path import abspath as path_abspath
 
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding as aes_padding
@@ -20,13 +26,25 @@ from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 from cryptography.hazmat.primitives.serialization import load_pem_public_key, load_pem_private_key
 from cryptography.hazmat.primitives import serialization, hashes, hmac
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.exceptions import InvalidSignature
 from base64 import b64encode,b64decode
 
+import re
 import zlib
+import hashlib
 import logging
 
 LOG = logging.getLogger(__name__)
 
+# Matches a single PEM block (BEGIN line to END line)
+_PEM_BLOCK_RE = re.compile(
+	rb"-----BEGIN [^-\n]+-----.+?-----END [^-\n]+-----", re.DOTALL)
+
+# RSA padding used for en/decryption (OAEP with SHA256)
+_OAEP = rsa_padding.OAEP(
+	mgf=rsa_padding.MGF1(algorithm=hashes.SHA256()),
+	algorithm=hashes.SHA256(), label=None)
+
 """\
 A retro user key consists of 2 different keys, a RSA-2048 key used
 for decryption and an ED25519 key used for signing.
@@ -102,11 +120,7 @@ class RetroPrivateKey:
 		if data_is_base64:
 			data = b64decode(data)
 
-		dec = self.rsa.decrypt(
-			data,
-			rsa_padding.OAEP(
-			  mgf=rsa_padding.MGF1(algorithm=hashes.SHA256()),
-			  algorithm=hashes.SHA256(), label=None))
+		dec = self.rsa.decrypt(data, _OAEP)
 		return dec
 
 
@@ -170,11 +184,23 @@ class RetroPublicKey:
 		"""\
 		Load both keys from a concatenated PEM string.
 		"""
-		start = pem.index("-----BEGIN")
-		end   = pem[start+1:].index("-----BEGIN")
-		k1 = pem[start:end-1].strip()
-		k2 = pem[end:].strip()
-		self.load_pem_strings(k1, k2)
+		self.load_pem_bytes(pem.encode('utf-8'))
+
+
+	def load_pem_bytes(self, pem):
+		"""\
+		Load both keys from a concatenated PEM buffer (bytes).
+		The buffer is passed to the PEM parser as is, without
+		decoding it to a string first.
+		Raises:
+		  ValueError: If buffer doesn't hold exactly two keys
+		"""
+		blocks = _PEM_BLOCK_RE.findall(pem)
+		if len(blocks) != 2:
+			raise ValueError("Expected 2 PEM keys, got {}"\
+				.format(len(blocks)))
+		self.rsa = load_pem_public_key(data=blocks[0])
+		self.ec  = load_pem_public_key(data=blocks[1])
 
 
 	def load_pem_strings(self, rsa_pem, ec_pem):
@@ -244,9 +270,7 @@ class RetroPublicKey:
 		Return:
 		  Encrypted data (bytes)
 		"""
-		enc = self.rsa.encrypt(data, rsa_padding.OAEP(
-			mgf=rsa_padding.MGF1(algorithm=hashes.SHA256()),
-			algorithm=hashes.SHA256(), label=None))
+		enc = self.rsa.encrypt(data, _OAEP)
 		return b64encode(enc) if encode_base64 else enc
 
 
@@ -347,10 +371,8 @@ def hash_sha256(data, return_hex=False):
 	Return:
 	  Sha256 hash
 	"""
-	h = hashes.Hash(hashes.SHA256())
-	h.update(data)
-	dig = h.finalize()
-	return dig.hex() if return_hex else dig
+	h = hashlib.sha256(data)
+	return h.hexdigest() if return_hex else h.digest()
 
 def hash_sha512(data, return_hex=False):
 	"""\
@@ -359,25 +381,26 @@ def hash_sha512(data, return_hex=False):
 	  data:  Data to hash
 	  return_hex: Return hash as hex?
 	Return:
-	  Sha256 hash
+	  Sha512 hash
 	"""
-	h = hashes.Hash(hashes.SHA512())
-	h.update(data)
-	dig = h.finalize()
-	return dig.hex() if return_hex else dig
+	h = hashlib.sha512(data)
+	return h.hexdigest() if return_hex else h.digest()
 
 
-def hmac_sha256(key, data):
+def hmac_sha256(key, *data):
 	"""\
 	Calculate HMAC-SHA256 from given data and given key.
 	Args:
-	  key:  Signing key
-	  data: Bytes to sign
+	  key:   Signing key
+	  *data: Bytes to sign. If more than one buffer is given,
+		 the HMAC is calculated over their concatenation
+		 without actually concatenating them.
 	Return:
 	  Signature (bytes)
 	"""
 	h = hmac.HMAC(key, hashes.SHA256())
-	h.update(data)
+	for buf in data:
+		h.update(buf)
 	sig = h.finalize()
 	return sig
 
@@ -391,7 +414,7 @@ def aes_encrypt(key, data):
 	Return:
 	  Encrypted,IV
 	"""
-	iv   = random_buffer(16)
+	iv   = os_urandom(16)
 	aes  = Cipher(algorithms.AES(key), modes.CBC(iv))
 
 	padder = aes_padding.PKCS7(256).padder()
@@ -434,17 +457,37 @@ def aes_encrypt_from_file(key, filepath):
 	  [16-47]  HMAC
 	  [48-...] CIPHER-TEXT
 
+	The file is read, compressed, encrypted and hashed chunk
+	by chunk, so only the resulting buffer is held in memory.
+
 	Return:
-	  IV+HMAC+CYPHER_TEXT
+	  IV+HMAC+CYPHER_TEXT (bytearray)
 	"""
-	f    = open(filepath, 'rb')
-	data = zlib.compress(f.read())
-	f.close()
+	iv   = os_urandom(16)
+	encr = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+	padder = aes_padding.PKCS7(256).padder()
+	comp   = zlib.compressobj(1)
+	h      = hmac.HMAC(key, hashes.SHA256())
+
+	# HMAC is filled in after all data is encrypted
+	out = bytearray(iv)
+	out += bytes(32)
+
+	with open(filepath, 'rb') as f:
+		while True:
+			chunk = f.read(0x10000)
+			if not chunk: break
+			ct = encr.update(padder.update(comp.compress(chunk)))
+			h.update(ct)
+			out += ct
 
-	enc,iv = aes_encrypt(key, data)
-	hmac   = hmac_sha256(key, enc)
+	ct = encr.update(padder.update(comp.flush()) + \
+			padder.finalize()) + encr.finalize()
+	h.update(ct)
+	out += ct
 
-	return iv+hmac+enc
+	out[16:48] = h.finalize()
+	return out
 
 
 def aes_decrypt_to_file(key, file_buf, filepath):
@@ -452,18 +495,86 @@ def aes_decrypt_to_file(key, file_buf, filepath):
 	Decrypt/Decompress file_buf (IV+HMAC+DATA)
 	and store it to given filepath.
 	"""
-	iv   = file_buf[:16]
-	hmac = file_buf[16:48]
-	enc  = file_buf[48:]
-
-	hmac2 = hmac_sha256(key, enc)
-	if hmac != hmac2:
-		raise Exception("HMAC's mismatch")
-
-	fout = open(filepath, 'wb')
-	dec  = aes_decrypt(key, enc, iv)
-	fout.write(zlib.decompress(dec))
-	fout.close()
+	aes_decrypt_chunks_to_file(key, (file_buf,), filepath)
+
+
+def aes_decrypt_chunks_to_file(key, chunks, filepath):
+	"""\
+	Decrypt/Decompress an encrypted file buffer (IV+HMAC+DATA,
+	see aes_encrypt_from_file) that is given as an iterable of
+	byte chunks, and store it to given filepath.
+
+	The received cipher text is written to an anonymous spool
+	file next to filepath while the HMAC is calculated, so the
+	whole buffer is never held in memory. Only after the HMAC
+	has been verified, the spool is decrypted/decompressed to
+	'<filepath>.part', which is renamed to filepath when done
+	and removed on error.
+
+	Raises:
+	  Exception: On HMAC mismatch or invalid/truncated data
+	"""
+	tmppath = filepath + '.part'
+	header  = bytearray()
+	h       = None
+
+	try:
+		# The spool file has no name, so it's removed when
+		# closed (or if the process dies).
+		with TemporaryFile(dir=path_dirname(
+				path_abspath(filepath))) as spool:
+			for chunk in chunks:
+				if not h:
+					# Collect IV and HMAC first
+					header += chunk
+					if len(header) < 48:
+						continue
+					iv    = bytes(header[:16])
+					hmac1 = bytes(header[16:48])
+					chunk = header[48:]
+					h = hmac.HMAC(key, hashes.SHA256())
+
+				h.update(chunk)
+				spool.write(chunk)
+
+			if not h:
+				raise Exception("File buffer too small")
+			try:
+				h.verify(hmac1)
+			except InvalidSignature:
+				raise Exception("HMAC's mismatch")
+
+			# Cipher text is authentic, decrypt it.
+			spool.seek(0)
+			decr = Cipher(algorithms.AES(key),
+				modes.CBC(iv)).decryptor()
+			unpadder = aes_padding.PKCS7(256).unpadder()
+			decomp   = zlib.decompressobj()
+
+			# The IV is not covered by the HMAC, so a bad IV
+			# still shows up as invalid padding/zlib data.
+			with open(tmppath, 'wb') as fout:
+				try:
+					while True:
+						chunk = spool.read(0x10000)
+						if not chunk: break
+						fout.write(decomp.decompress(
+							unpadder.update(decr.update(chunk))))
+
+					dec = unpadder.update(decr.finalize()) \
+						+ unpadder.finalize()
+					fout.write(decomp.decompress(dec))
+					fout.write(decomp.flush())
+				except (ValueError, zlib.error):
+					raise Exception("Invalid file data")
+				if not decomp.eof:
+					raise Exception("Truncated file data")
+
+		os_replace(tmppath, filepath)
+	except:
+		with suppress(FileNotFoundError):
+			os_remove(tmppath)
+		raise
 
 
 
@@ -0,0 +1,68 @@
+from sqlcipher3 import dbapi2 as sqlcipher
+import logging
+
+from libretro.crypto import hash_sha256
+
+LOG = logging.getLogger(__name__)
+
+"""\
+Helpers for opening the encrypted (sqlcipher) databases.
+
+The friend and message databases are keyed with values that
+already are the output of a key derivation function (see
+crypto.derive_key). Passing such a value as passphrase makes
+sqlcipher run its own PBKDF2 (256000 iterations) on every open,
+which takes a few hundred milliseconds. Instead, these databases
+are keyed with a raw 256 bit key, sha256(passphrase), which
+sqlcipher uses as is.
+
+The account database is not opened this way. It is only protected
+by the user's password, so sqlcipher's KDF is kept there to make
+password guessing more expensive.
+"""
+
+
+def sqlcipher_connect(path, passphrase):
+	"""\
+	Open the sqlcipher database at given path.
+
+	Databases created by older versions, which are keyed with
+	the passphrase itself, are rekeyed to the raw key when they
+	are opened for the first time.
+
+	Args:
+	  path:       Path to database file
+	  passphrase: Database key (derived key as string)
+	Return:
+	  Database connection
+	Raises:
+	  sqlcipher.DatabaseError: If the key is wrong
+	"""
+	rawkey = "\"x'" + hash_sha256(passphrase.encode(), True) + "'\""
+
+	db = sqlcipher.connect(path, check_same_thread=False)
+	db.execute("PRAGMA key=" + rawkey)
+	try:
+		db.execute("SELECT count(*) FROM sqlite_master")
+		return db
+	except sqlcipher.DatabaseError as e:
+		db.close()
+		# Only a wrong key ('file is not a database') means
+		# the database still uses the passphrase key. Other
+		# errors (e.g. 'database is locked') are raised as is.
+		if isinstance(e, sqlcipher.OperationalError):
+			raise
+
+	# Database still uses the passphrase key, open it
+	# the old way and switch it to the raw key.
+	db = sqlcipher.connect(path, check_same_thread=False)
+	try:
+		db.execute("PRAGMA key='" + passphrase + "'")
+		db.execute("SELECT count(*) FROM sqlite_master")
+		db.execute("PRAGMA rekey=" + rawkey)
+	except:
+		db.close()
+		raise
+
+	LOG.info("Rekeyed database %s", path)
+	return db
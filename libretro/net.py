@@ -1,5 +1,5 @@
 import socket
-from ssl import SSLContext, PROTOCOL_TLS_SERVER, PROTOCOL_TLS_CLIENT
+from ssl import SSLContext, SSLSocket, PROTOCOL_TLS_SERVER, PROTOCOL_TLS_CLIENT
 import json
 import select
 import logging
@@ -99,6 +99,22 @@ class NetClient:
 			return self.conn.recv(max_bytes)
 		else:	return False
 
+	def recv_into(self, buf, nbytes=0, timeout_sec=None):
+		"""\
+		Receive data directly into given (writable) buffer.
+		Args:
+		  buf:    bytearray or memoryview to write to
+		  nbytes: Max bytes to receive (0 means len(buf))
+		Return:
+		  Number of bytes received (0 if connection closed)
+		  False: Timeout
+		Raises:
+		  if failed to receive/select
+		"""
+		if can_read(self.conn, timeout_sec):
+			return self.conn.recv_into(buf, nbytes)
+		else:	return False
+
 	def recv_all(self, n_bytes, timeout_sec=None):
 		"""\
 		Receive n bytes.
@@ -190,6 +206,11 @@ def can_read(conn, timeout_sec):
 	if not timeout_sec:
 		return True
 
+	# Data that was already received and decrypted by the
+	# ssl layer is not visible to select().
+	if isinstance(conn, SSLSocket) and conn.pending():
+		return True
+
 	ready = select.select([conn], [],
 			[], timeout_sec)
 	if ready[0]: